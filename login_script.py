@@ -4,35 +4,148 @@
 # 优化版本: 增强的选择器、重试机制、详细日志
 
 import os
+import re
 import sys
 import time
-import pyotp  # 用于生成 2FA 验证码
+from urllib.parse import urlparse
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
 
 # ==================== 配置项 ====================
 CLAW_CLOUD_URL = "https://ap-northeast-1.run.claw.cloud/"
-MAX_2FA_RETRIES = 3  # 2FA 验证码重试次数
-WAIT_AFTER_2FA = 5   # 2FA 提交后等待秒数
-FINAL_WAIT = 25      # 最终跳转等待秒数
+MAX_2FA_RETRIES = 2  # 2FA 验证码尝试次数（提交前已对齐周期，一般一次即可）
+TOTP_MIN_REMAINING = 3  # 当前验证码剩余有效秒数低于此值时，等下一个周期再生成
+WAIT_AFTER_2FA = 10  # 2FA 提交后最长等待秒数
+FINAL_WAIT = 25      # 最终跳转最长等待秒数
+DEBUG = os.environ.get("LOGIN_DEBUG") == "1"  # 调试模式：保存每一步的截图
+# 登录流程不需要的资源类型（样式表保留，元素可见性判断依赖它）
+BLOCKED_RESOURCE_TYPES = ("image", "font", "media")
+AUTH_STATE_FILE = "auth_state.json"  # 登录状态（Cookie/localStorage）缓存文件
+AUTH_STATE_MAX_AGE = 8 * 3600        # 登录状态缓存有效秒数
+
+# 日志级别图标
+LOG_ICONS = {
+    "INFO": "ℹ️",
+    "SUCCESS": "✅",
+    "ERROR": "❌",
+    "WARN": "⚠️",
+    "STEP": "🔹"
+}
+
+# ==================== 选择器 ====================
+# 每组选择器在导入时合并为一个 CSS 选择器组，由 find_visible 一次匹配
+
+# ClawCloud 的 GitHub 登录按钮
+GITHUB_BUTTON_SELECTOR = ", ".join((
+    "button:has-text('GitHub')",
+    "a:has-text('GitHub')",
+    "[data-provider='github']",
+    "button[data-test='github-login']",
+    ".github-login-button"
+))
+
+# GitHub 登录表单提交按钮
+LOGIN_SUBMIT_SELECTOR = ", ".join((
+    "input[name='commit']",
+    "input[type='submit']",
+    "button[type='submit']",
+    "button:has-text('Sign in')"
+))
+
+# 所有可能的 2FA 输入框
+OTP_INPUT_SELECTOR = ", ".join((
+    "#app_totp",              # App 验证（最常见）
+    "#otp",                   # 标准 OTP
+    "#sms_otp",               # 短信验证
+    "input[name='otp']",
+    "input[name='app_otp']",
+    "input[autocomplete='one-time-code']",
+    "input[type='text'][inputmode='numeric']",
+    "input[aria-label*='code' i]",
+    "input[placeholder*='code' i]",
+    "input.form-control[type='text']"
+))
+
+# 2FA 错误提示
+OTP_ERROR_SELECTOR = ", ".join((
+    ".flash-error",
+    ".js-flash-alert",
+    "[role='alert']"
+))
+
+# OAuth 授权按钮
+OAUTH_AUTHORIZE_SELECTOR = ", ".join((
+    "button[name='authorize']",
+    "button:has-text('Authorize')",
+    "input[name='authorize']",
+    "button.btn-primary:has-text('Authorize')"
+))
+
+# 用户菜单等登录后才有的元素
+USER_MENU_SELECTOR = ", ".join((
+    "[data-testid='user-menu']",
+    "button[aria-label*='user' i]",
+    ".user-avatar",
+    "[class*='avatar']"
+))
+
+# GitHub 各类页面的 URL 特征，一次匹配得到页面类型（分组名）
+URL_ROUTER = re.compile(
+    r"(?P<oauth>github\.com/login/oauth/authorize)"
+    r"|(?P<tfa>two-factor)"
+    r"|(?P<dev>verified-device|device-verification)"
+    r"|(?P<gh>github\.com/(?:login|session)(?![\w/-]))"
+)
+
+# ClawCloud 控制台特征元素
+DASHBOARD_TEXT_PATTERN = "App Launchpad|Devbox|Dashboard"
+DASHBOARD_MARKER = f"text=/{DASHBOARD_TEXT_PATTERN}/"
+
+# ClawCloud 控制台特征文字
+DASHBOARD_TEXT_CHECKS = (
+    ("App Launchpad", "应用启动台"),
+    ("Devbox", "开发环境"),
+    ("Dashboard", "控制台"),
+    ("Create", "创建按钮"),
+    ("Workspace", "工作空间")
+)
 
 
 def log_step(msg, level="INFO"):
     """统一日志输出"""
-    icons = {
-        "INFO": "ℹ️",
-        "SUCCESS": "✅",
-        "ERROR": "❌",
-        "WARN": "⚠️",
-        "STEP": "🔹"
-    }
-    icon = icons.get(level, "•")
-    print(f"{icon} {msg}")
-
-
-def safe_screenshot(page, filename, description=""):
-    """安全截图（即使失败也不中断）"""
+    print(f"{LOG_ICONS.get(level, '•')} {msg}")
+
+
+def check_config():
+    """检查环境变量配置，缺少必需项时直接退出；返回 (用户名, 密码, 2FA 密钥)"""
+    print("\n" + "="*60)
+    print("🚀 ClawCloud 自动登录脚本 (优化版 v2.0)")
+    print("="*60 + "\n")
+    
+    # 1. 获取环境变量
+    username = os.environ.get("GH_USERNAME")
+    password = os.environ.get("GH_PASSWORD")
+    totp_secret = os.environ.get("GH_2FA_SECRET")
+    
+    log_step("配置检查:", "STEP")
+    log_step(f"  用户名: {username[:3]}*** (已设置)" if username else "  用户名: 未设置 ❌", "INFO")
+    log_step(f"  密码: ******** (已设置)" if password else "  密码: 未设置 ❌", "INFO")
+    log_step(f"  2FA Secret: {'已设置 ✅' if totp_secret else '未设置 ⚠️'}", "INFO")
+    
+    if not username or not password:
+        log_step("错误: 必须设置 GH_USERNAME 和 GH_PASSWORD 环境变量", "ERROR")
+        log_step("请在 GitHub Secrets 中配置这些值", "ERROR")
+        sys.exit(1)
+    
+    print()
+    return username, password, totp_secret
+
+
+def safe_screenshot(page, filename, description="", force=False, full_page=False):
+    """安全截图（即使失败也不中断）；非调试模式下只保存 force=True 的截图"""
+    if not DEBUG and not force:
+        return False
     try:
-        page.screenshot(path=filename, full_page=True)
+        page.screenshot(path=filename, full_page=full_page)
         log_step(f"已保存截图: {filename}", "SUCCESS")
         if description:
             log_step(f"  说明: {description}")
@@ -42,17 +155,62 @@ def safe_screenshot(page, filename, description=""):
         return False
 
 
-def try_click(page, selectors, description="按钮", timeout=5000):
+def find_visible(page, selector, timeout=5000):
+    """按选择器组一次等待，返回第一个可见元素（找不到返回 None）
+
+    组内所有选择器由浏览器同时匹配，任意一个出现即返回，无需逐个或并发探测。
+    """
+    element = page.locator(f"{selector} >> visible=true").first
+    try:
+        element.wait_for(state="visible", timeout=timeout)
+        return element
+    except PlaywrightTimeout:
+        return None
+
+
+def route_page(url):
+    """根据 URL 判断当前所在页面类型: gh / dev / tfa / oauth（无匹配返回 None）"""
+    m = URL_ROUTER.search(url)
+    return m.lastgroup if m else None
+
+
+def is_clawcloud_console(url):
+    """URL 是否已回到 ClawCloud 且不在登录页（只看域名和路径，忽略 redirect_uri 等参数）"""
+    parsed = urlparse(url)
+    return (parsed.hostname or "").endswith("claw.cloud") and "signin" not in parsed.path.lower()
+
+
+def load_auth_state():
+    """返回未过期的登录状态缓存文件路径（不存在或已过期返回 None）"""
+    try:
+        age = time.time() - os.path.getmtime(AUTH_STATE_FILE)
+    except OSError:
+        return None
+    if age > AUTH_STATE_MAX_AGE:
+        log_step(f"登录状态缓存已过期 ({age / 3600:.1f} 小时)", "INFO")
+        return None
+    return AUTH_STATE_FILE
+
+
+def block_heavy_resources(route):
+    """拦截图片/字体/媒体请求，加快页面加载"""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+def try_click(page, selector, description="按钮", timeout=5000):
     """尝试多个选择器点击（智能查找）"""
-    for selector in selectors:
+    element = find_visible(page, selector, timeout)
+    if element:
         try:
-            element = page.locator(selector).first
-            if element.is_visible(timeout=timeout):
-                element.click()
-                log_step(f"已点击: {description} ({selector})", "SUCCESS")
-                return True
-        except:
-            continue
+            element.click()
+            log_step(f"已点击: {description}", "SUCCESS")
+            return True
+        except Exception as e:
+            log_step(f"点击 {description} 失败: {e}", "WARN")
+            return False
     log_step(f"未找到: {description}", "WARN")
     return False
 
@@ -65,13 +223,11 @@ def fill_github_credentials(page, username, password):
     try:
         page.wait_for_selector("#login_field", state="visible", timeout=10000)
         
-        # 清空并填写用户名
-        page.fill("#login_field", "")
+        # 填写用户名（fill 会先清空输入框）
         page.fill("#login_field", username)
         log_step(f"已填写用户名: {username[:3]}***")
         
-        # 清空并填写密码
-        page.fill("#password", "")
+        # 填写密码
         page.fill("#password", password)
         log_step("已填写密码: ********")
         
@@ -79,24 +235,17 @@ def fill_github_credentials(page, username, password):
         safe_screenshot(page, "01_credentials_filled.png", "凭据已填写")
         
         # 提交表单
-        submit_selectors = [
-            "input[name='commit']",
-            "input[type='submit']",
-            "button[type='submit']",
-            "button:has-text('Sign in')"
-        ]
-        
-        if try_click(page, submit_selectors, "登录按钮"):
+        if try_click(page, LOGIN_SUBMIT_SELECTOR, "登录按钮"):
             log_step("登录表单已提交", "SUCCESS")
             return True
         else:
             log_step("找不到提交按钮", "ERROR")
-            safe_screenshot(page, "error_no_submit_button.png")
+            safe_screenshot(page, "error_no_submit_button.png", force=True)
             return False
             
     except Exception as e:
         log_step(f"填写凭据失败: {e}", "ERROR")
-        safe_screenshot(page, "error_fill_credentials.png")
+        safe_screenshot(page, "error_fill_credentials.png", force=True)
         return False
 
 
@@ -110,109 +259,74 @@ def handle_2fa_verification(page, totp_secret):
         log_step("请在 GitHub Secrets 中添加 GH_2FA_SECRET", "ERROR")
         return False
     
-    # 所有可能的 2FA 输入框选择器
-    input_selectors = [
-        "#app_totp",              # App 验证（最常见）
-        "#otp",                   # 标准 OTP
-        "#sms_otp",               # 短信验证
-        "input[name='otp']",
-        "input[name='app_otp']",
-        "input[autocomplete='one-time-code']",
-        "input[type='text'][inputmode='numeric']",
-        "input[aria-label*='code' i]",
-        "input[placeholder*='code' i]",
-        "input.form-control[type='text']"
-    ]
+    import pyotp  # 用于生成 2FA 验证码，仅在需要 2FA 时导入
     
-    # 所有可能的提交按钮选择器
-    submit_selectors = [
-        "button[type='submit']",
-        "input[type='submit']",
-        "button:has-text('Verify')",
-        "button:has-text('验证')",
-        "button.btn-primary"
-    ]
+    # TOTP 对象只创建一次，重试时复用
+    try:
+        totp = pyotp.TOTP(totp_secret)
+    except Exception as e:
+        log_step(f"初始化 TOTP 失败: {e}", "ERROR")
+        return False
     
     for attempt in range(MAX_2FA_RETRIES):
         log_step(f"🔢 尝试 {attempt + 1}/{MAX_2FA_RETRIES}...", "STEP")
         
-        # 生成新的验证码
-        try:
-            totp = pyotp.TOTP(totp_secret)
-            code = totp.now()
-            log_step(f"生成验证码: {code}", "SUCCESS")
-        except Exception as e:
-            log_step(f"生成验证码失败: {e}", "ERROR")
-            return False
-        
-        # 查找输入框
-        input_element = None
-        used_selector = None
-        
-        for selector in input_selectors:
-            try:
-                element = page.locator(selector).first
-                if element.is_visible(timeout=2000):
-                    input_element = element
-                    used_selector = selector
-                    log_step(f"找到输入框: {selector}", "SUCCESS")
-                    break
-            except:
-                continue
+        # 查找输入框（所有选择器合并为一次查找）
+        input_element = find_visible(page, OTP_INPUT_SELECTOR, timeout=5000)
         
-        if not input_element:
+        if input_element:
+            log_step("找到 2FA 输入框", "SUCCESS")
+        else:
             log_step("未找到任何 2FA 输入框", "ERROR")
-            safe_screenshot(page, "error_no_2fa_input.png")
-            
-            # 尝试等待页面加载
-            log_step("等待页面完全加载...", "WARN")
-            time.sleep(3)
+            safe_screenshot(page, "error_no_2fa_input.png", force=True)
             
             # 最后一次尝试
             if attempt == MAX_2FA_RETRIES - 1:
                 return False
             continue
         
+        # 生成新的验证码（临近周期边界时先等到下一个周期，保证提交时仍有效）
+        remaining = totp.interval - (time.time() % totp.interval)
+        if remaining < TOTP_MIN_REMAINING:
+            log_step(f"当前验证码仅剩 {remaining:.1f} 秒，等待下一个周期...", "INFO")
+            time.sleep(remaining + 0.5)
+        try:
+            code = totp.now()
+            log_step(f"生成验证码: {code}", "SUCCESS")
+        except Exception as e:
+            log_step(f"生成验证码失败: {e}", "ERROR")
+            return False
+        
         # 填写验证码
         try:
-            # 清空输入框
-            input_element.clear()
-            time.sleep(0.5)
-            
-            # 填入验证码
+            # 填入验证码（fill 会先清空输入框）
             input_element.fill(code)
             log_step(f"已填入验证码: {code}", "SUCCESS")
-            time.sleep(0.5)
             
             # 截图
             safe_screenshot(page, f"03_2fa_code_entered_{attempt+1}.png", f"验证码已输入 (尝试{attempt+1})")
             
-            # 查找并点击提交按钮
-            submit_clicked = False
-            for selector in submit_selectors:
+            # 直接按回车提交（GitHub 2FA 表单支持回车提交，无需查找提交按钮）
+            # 输满 6 位后 GitHub 可能已自动提交，此时不再按回车
+            if route_page(page.url) == "tfa":
                 try:
-                    btn = page.locator(selector).first
-                    if btn.is_visible(timeout=2000):
-                        btn.click()
-                        log_step(f"已点击提交按钮: {selector}", "SUCCESS")
-                        submit_clicked = True
-                        break
-                except:
-                    continue
-            
-            # 如果没有找到提交按钮，尝试按回车键
-            if not submit_clicked:
-                log_step("未找到提交按钮，尝试按回车键", "WARN")
-                input_element.press("Enter")
-                log_step("已按回车键提交", "SUCCESS")
+                    input_element.press("Enter", timeout=2000)
+                    log_step("已按回车键提交", "SUCCESS")
+                except PlaywrightTimeout:
+                    log_step("按回车超时，页面可能已自动提交", "WARN")
+            else:
+                log_step("验证码已自动提交", "SUCCESS")
             
-            # 等待页面响应
-            log_step(f"等待 {WAIT_AFTER_2FA} 秒，检查验证结果...", "INFO")
-            time.sleep(WAIT_AFTER_2FA)
+            # 等待离开 2FA 页面
+            log_step(f"等待验证结果（最长 {WAIT_AFTER_2FA} 秒）...", "INFO")
+            try:
+                page.wait_for_url(lambda u: "two-factor" not in u, timeout=WAIT_AFTER_2FA * 1000)
+            except PlaywrightTimeout:
+                log_step("仍停留在 2FA 页面", "WARN")
             
-            # 等待网络空闲
+            # 等待新页面 DOM 就绪
             try:
-                page.wait_for_load_state("networkidle", timeout=10000)
+                page.wait_for_load_state("domcontentloaded", timeout=10000)
             except PlaywrightTimeout:
                 log_step("页面加载超时，继续检查...", "WARN")
             
@@ -221,24 +335,17 @@ def handle_2fa_verification(page, totp_secret):
             log_step(f"当前 URL: {current_url}")
             
             # 成功的标志：已离开 2FA 页面
-            if 'two-factor' not in current_url and 'sessions/two-factor' not in current_url:
+            if route_page(current_url) != "tfa":
                 log_step("2FA 验证成功！", "SUCCESS")
                 safe_screenshot(page, "04_2fa_success.png", "2FA 验证成功")
                 return True
             
             # 检查是否有错误提示
             try:
-                error_selectors = [
-                    ".flash-error",
-                    ".js-flash-alert",
-                    "[role='alert']"
-                ]
-                for err_sel in error_selectors:
-                    error_elem = page.locator(err_sel).first
-                    if error_elem.is_visible(timeout=1000):
-                        error_text = error_elem.inner_text()
-                        log_step(f"错误提示: {error_text}", "ERROR")
-                        break
+                error_elem = find_visible(page, OTP_ERROR_SELECTOR, timeout=1000)
+                if error_elem:
+                    error_text = error_elem.inner_text()
+                    log_step(f"错误提示: {error_text}", "ERROR")
             except:
                 pass
             
@@ -246,12 +353,18 @@ def handle_2fa_verification(page, totp_secret):
             log_step(f"验证码 {code} 验证失败，可能已过期", "WARN")
             
             if attempt < MAX_2FA_RETRIES - 1:
-                log_step("等待新验证码生成（30秒周期）...", "INFO")
-                time.sleep(32 - (time.time() % 30))  # 等到下一个30秒周期
+                log_step(f"等待新验证码生成（{totp.interval}秒周期）...", "INFO")
+                time.sleep(totp.interval - (time.time() % totp.interval) + 1)  # 等到下一个周期
             
         except Exception as e:
+            # 页面已离开 2FA（例如自动提交导致的导航），视为验证成功
+            if route_page(page.url) != "tfa":
+                log_step("2FA 验证成功！", "SUCCESS")
+                safe_screenshot(page, "04_2fa_success.png", "2FA 验证成功")
+                return True
+            
             log_step(f"填写验证码异常: {e}", "ERROR")
-            safe_screenshot(page, f"error_2fa_fill_{attempt+1}.png")
+            safe_screenshot(page, f"error_2fa_fill_{attempt+1}.png", force=True)
             
             if attempt < MAX_2FA_RETRIES - 1:
                 time.sleep(3)
@@ -265,42 +378,24 @@ def handle_2fa_verification(page, totp_secret):
 def handle_device_verification(page):
     """处理设备验证（邮件/App 批准）"""
     log_step("📧 检测到设备验证请求", "WARN")
-    safe_screenshot(page, "device_verification.png", "设备验证页面")
+    safe_screenshot(page, "device_verification.png", "设备验证页面", force=True)
     
     log_step("请在 60 秒内完成以下操作之一:", "WARN")
     log_step("  1. 检查邮箱并点击验证链接", "INFO")
     log_step("  2. 在 GitHub App 中批准设备", "INFO")
     log_step("  3. 访问 https://github.com/settings/security", "INFO")
     
-    # 等待 60 秒
-    for i in range(60):
-        time.sleep(1)
-        
-        if i % 10 == 0:
-            log_step(f"  等待中... ({i}/60 秒)")
-            try:
-                current_url = page.url
-                # 检查是否已离开验证页面
-                if 'verified-device' not in current_url and 'device-verification' not in current_url:
-                    log_step("设备验证完成！", "SUCCESS")
-                    return True
-                
-                # 尝试刷新页面状态
-                page.evaluate("() => {}")
-            except:
-                pass
-    
-    # 超时后最终检查
+    # 等待离开验证页面（最长 60 秒）
     try:
-        final_url = page.url
-        if 'verified-device' not in final_url and 'device-verification' not in final_url:
-            log_step("设备验证完成！", "SUCCESS")
-            return True
-    except:
-        pass
-    
-    log_step("设备验证超时", "ERROR")
-    return False
+        page.wait_for_url(
+            lambda u: 'verified-device' not in u and 'device-verification' not in u,
+            timeout=60000
+        )
+        log_step("设备验证完成！", "SUCCESS")
+        return True
+    except PlaywrightTimeout:
+        log_step("设备验证超时", "ERROR")
+        return False
 
 
 def handle_oauth_authorization(page):
@@ -308,16 +403,12 @@ def handle_oauth_authorization(page):
     log_step("🔓 检测到授权请求页面", "STEP")
     safe_screenshot(page, "05_oauth_authorize.png", "OAuth 授权")
     
-    authorize_selectors = [
-        "button[name='authorize']",
-        "button:has-text('Authorize')",
-        "input[name='authorize']",
-        "button.btn-primary:has-text('Authorize')"
-    ]
-    
-    if try_click(page, authorize_selectors, "Authorize 按钮", timeout=3000):
+    if try_click(page, OAUTH_AUTHORIZE_SELECTOR, "Authorize 按钮", timeout=3000):
         log_step("已点击授权", "SUCCESS")
-        time.sleep(3)
+        try:
+            page.wait_for_url(lambda u: "oauth/authorize" not in u, timeout=10000)
+        except PlaywrightTimeout:
+            log_step("授权后页面未跳转", "WARN")
         return True
     else:
         log_step("未找到授权按钮，可能自动跳过", "WARN")
@@ -335,7 +426,7 @@ def verify_login_success(page):
     success_indicators = []
     
     # 检查 1: URL 特征
-    if 'claw.cloud' in final_url and 'signin' not in final_url:
+    if is_clawcloud_console(final_url):
         success_indicators.append("URL 正确")
     
     # 检查 2: 不在 GitHub 验证页
@@ -343,35 +434,24 @@ def verify_login_success(page):
         success_indicators.append("已离开 GitHub")
     
     # 检查 3: 页面特征文字
-    page_text_checks = [
-        ("App Launchpad", "应用启动台"),
-        ("Devbox", "开发环境"),
-        ("Dashboard", "控制台"),
-        ("Create", "创建按钮"),
-        ("Workspace", "工作空间")
-    ]
-    
-    for text, description in page_text_checks:
-        try:
-            if page.get_by_text(text).count() > 0:
+    # 一次 evaluate 在页面内检查所有文字，避免逐个往返
+    try:
+        found = page.evaluate(
+            "terms => { const t = document.body.innerText; return terms.filter(x => t.includes(x)); }",
+            [text for text, _ in DASHBOARD_TEXT_CHECKS]
+        )
+        for text, description in DASHBOARD_TEXT_CHECKS:
+            if text in found:
                 success_indicators.append(f"找到'{description}'")
                 break
-        except:
-            continue
+    except:
+        pass
     
     # 检查 4: 特定元素
     try:
         # 检查是否有用户菜单等登录后才有的元素
-        user_menu_selectors = [
-            "[data-testid='user-menu']",
-            "button[aria-label*='user' i]",
-            ".user-avatar",
-            "[class*='avatar']"
-        ]
-        for selector in user_menu_selectors:
-            if page.locator(selector).count() > 0:
-                success_indicators.append("找到用户菜单")
-                break
+        if page.locator(USER_MENU_SELECTOR).count() > 0:
+            success_indicators.append("找到用户菜单")
     except:
         pass
     
@@ -383,29 +463,8 @@ def verify_login_success(page):
     return is_success
 
 
-def run_login():
-    """主登录流程"""
-    print("\n" + "="*60)
-    print("🚀 ClawCloud 自动登录脚本 (优化版 v2.0)")
-    print("="*60 + "\n")
-    
-    # 1. 获取环境变量
-    username = os.environ.get("GH_USERNAME")
-    password = os.environ.get("GH_PASSWORD")
-    totp_secret = os.environ.get("GH_2FA_SECRET")
-    
-    log_step("配置检查:", "STEP")
-    log_step(f"  用户名: {username[:3]}*** (已设置)" if username else "  用户名: 未设置 ❌", "INFO")
-    log_step(f"  密码: ******** (已设置)" if password else "  密码: 未设置 ❌", "INFO")
-    log_step(f"  2FA Secret: {'已设置 ✅' if totp_secret else '未设置 ⚠️'}", "INFO")
-    
-    if not username or not password:
-        log_step("错误: 必须设置 GH_USERNAME 和 GH_PASSWORD 环境变量", "ERROR")
-        log_step("请在 GitHub Secrets 中配置这些值", "ERROR")
-        sys.exit(1)
-    
-    print()
-    
+def run_login(username, password, totp_secret):
+    """主登录流程（配置由 check_config 检查后传入）"""
     # 2. 启动浏览器
     log_step("启动浏览器...", "STEP")
     with sync_playwright() as p:
@@ -414,99 +473,142 @@ def run_login():
             args=[
                 '--no-sandbox',
                 '--disable-setuid-sandbox',
-                '--disable-dev-shm-usage'
+                '--disable-dev-shm-usage',
+                '--disable-blink-features=AutomationControlled',
+                '--disable-extensions',
+                '--disable-background-networking',
+                '--disable-sync',
+                '--disable-default-apps',
+                '--disable-translate',
+                '--mute-audio',
+                '--no-first-run'
             ]
         )
         
+        auth_state = load_auth_state()
+        if auth_state:
+            log_step(f"使用登录状态缓存: {auth_state}", "INFO")
+        
         context = browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
+            storage_state=auth_state,
+            viewport={'width': 1280, 'height': 720},
             user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         )
         
+        context.route("**/*", block_heavy_resources)
+        
         page = context.new_page()
         
         try:
             # 3. 访问 ClawCloud
             log_step(f"访问 ClawCloud: {CLAW_CLOUD_URL}", "STEP")
-            page.goto(CLAW_CLOUD_URL, timeout=60000)
-            page.wait_for_load_state("networkidle", timeout=30000)
-            time.sleep(2)
+            page.goto(CLAW_CLOUD_URL, timeout=20000, wait_until="domcontentloaded")
             safe_screenshot(page, "00_clawcloud_home.png", "ClawCloud 首页")
             
-            # 4. 点击 GitHub 登录按钮
-            log_step("查找 GitHub 登录按钮...", "STEP")
-            github_button_selectors = [
-                "button:has-text('GitHub')",
-                "a:has-text('GitHub')",
-                "[data-provider='github']",
-                "button[data-test='github-login']",
-                ".github-login-button"
-            ]
-            
-            if not try_click(page, github_button_selectors, "GitHub 登录按钮", timeout=10000):
-                # 可能已经登录
-                if 'signin' not in page.url.lower():
+            # 已有有效会话时直接进入控制台，跳过 GitHub 登录流程
+            already_logged_in = False
+            if auth_state:
+                # 出现控制台特征文字或跳到登录页，任一条件满足即结束等待
+                try:
+                    page.wait_for_function(
+                        """pattern => location.pathname.toLowerCase().includes('signin')
+                            || (document.body && new RegExp(pattern).test(document.body.innerText))""",
+                        arg=DASHBOARD_TEXT_PATTERN,
+                        timeout=10000
+                    )
+                    already_logged_in = is_clawcloud_console(page.url)
+                except PlaywrightTimeout:
+                    pass
+                if already_logged_in:
+                    log_step("登录状态缓存有效，跳过 GitHub 登录", "SUCCESS")
+                else:
+                    log_step("登录状态缓存无效，重新登录", "WARN")
+                    try:
+                        os.remove(AUTH_STATE_FILE)
+                    except OSError:
+                        pass
+            
+            if not already_logged_in:
+                # 4. 点击 GitHub 登录按钮
+                log_step("查找 GitHub 登录按钮...", "STEP")
+                if try_click(page, GITHUB_BUTTON_SELECTOR, "GitHub 登录按钮", timeout=10000):
+                    # 5. 等待跳转到 GitHub（OAuth 可能直接 302 回到 ClawCloud）
+                    log_step("等待跳转到 GitHub...", "STEP")
+                    try:
+                        page.wait_for_url(
+                            lambda u: "github.com" in u or is_clawcloud_console(u),
+                            timeout=15000
+                        )
+                    except PlaywrightTimeout:
+                        log_step("未跳转到 GitHub，继续检查当前页面...", "WARN")
+                elif 'signin' not in page.url.lower():
+                    # 可能已经登录
                     log_step("可能已经登录，跳过 GitHub 按钮", "WARN")
                 else:
                     log_step("找不到 GitHub 登录按钮", "ERROR")
-                    safe_screenshot(page, "error_no_github_button.png")
-                    sys.exit(1)
-            
-            # 5. 等待跳转到 GitHub
-            log_step("等待跳转到 GitHub...", "STEP")
-            time.sleep(3)
-            page.wait_for_load_state("networkidle", timeout=30000)
-            
-            current_url = page.url
-            log_step(f"当前 URL: {current_url}")
-            
-            # 6. 处理 GitHub 登录
-            if "github.com/login" in current_url or "github.com/session" in current_url:
-                if not fill_github_credentials(page, username, password):
-                    log_step("GitHub 登录失败", "ERROR")
+                    safe_screenshot(page, "error_no_github_button.png", force=True)
                     sys.exit(1)
                 
-                # 等待登录响应
-                time.sleep(3)
-                page.wait_for_load_state("networkidle", timeout=30000)
-                current_url = page.url
-                log_step(f"登录后 URL: {current_url}")
-            
-            # 7. 处理设备验证（如果需要）
-            if 'verified-device' in current_url or 'device-verification' in current_url:
-                if not handle_device_verification(page):
-                    log_step("设备验证失败", "ERROR")
-                    sys.exit(1)
                 current_url = page.url
+                log_step(f"当前 URL: {current_url}")
+                route = route_page(current_url)
+                
+                # 6. 处理 GitHub 登录
+                if route == "gh":
+                    if not fill_github_credentials(page, username, password):
+                        log_step("GitHub 登录失败", "ERROR")
+                        sys.exit(1)
+                
+                    # 等待登录响应（离开登录表单页）
+                    try:
+                        page.wait_for_selector("#login_field", state="detached", timeout=15000)
+                    except PlaywrightTimeout:
+                        log_step("登录后页面未跳转", "WARN")
+                    try:
+                        page.wait_for_load_state("domcontentloaded", timeout=10000)
+                    except PlaywrightTimeout:
+                        log_step("页面加载超时，继续检查...", "WARN")
+                    current_url = page.url
+                    log_step(f"登录后 URL: {current_url}")
+                    route = route_page(current_url)
+                
+                # 7. 处理设备验证（如果需要）
+                if route == "dev":
+                    if not handle_device_verification(page):
+                        log_step("设备验证失败", "ERROR")
+                        sys.exit(1)
+                    route = route_page(page.url)
+                
+                # 8. 处理 2FA（如果需要）
+                if route == "tfa":
+                    if not handle_2fa_verification(page, totp_secret):
+                        log_step("2FA 验证失败", "ERROR")
+                        safe_screenshot(page, "final_error_2fa.png", force=True)
+                        sys.exit(1)
+                    route = route_page(page.url)
+                
+                # 9. 处理 OAuth 授权（如果需要）
+                if route == "oauth":
+                    handle_oauth_authorization(page)
             
-            # 8. 处理 2FA（如果需要）
-            if 'two-factor' in current_url or 'sessions/two-factor' in current_url:
-                if not handle_2fa_verification(page, totp_secret):
-                    log_step("2FA 验证失败", "ERROR")
-                    safe_screenshot(page, "final_error_2fa.png")
-                    sys.exit(1)
-                current_url = page.url
-            
-            # 9. 处理 OAuth 授权（如果需要）
-            time.sleep(2)
-            if 'github.com/login/oauth/authorize' in current_url:
-                handle_oauth_authorization(page)
-                time.sleep(3)
-                page.wait_for_load_state("networkidle", timeout=30000)
-            
-            # 10. 等待最终跳转
-            log_step(f"等待最终跳转 ({FINAL_WAIT} 秒)...", "STEP")
-            time.sleep(FINAL_WAIT)
-            
+            # 10. 等待最终跳转（回到 ClawCloud 控制台）
+            log_step(f"等待最终跳转（最长 {FINAL_WAIT} 秒）...", "STEP")
             try:
-                page.wait_for_load_state("networkidle", timeout=15000)
+                page.wait_for_url(is_clawcloud_console, timeout=FINAL_WAIT * 1000)
+                page.locator(DASHBOARD_MARKER).first.wait_for(timeout=10000)
             except PlaywrightTimeout:
-                log_step("页面加载超时，继续验证...", "WARN")
+                log_step("等待控制台超时，继续验证...", "WARN")
             
             # 11. 验证登录成功
-            safe_screenshot(page, "99_final_result.png", "最终登录结果")
+            safe_screenshot(page, "99_final_result.png", "最终登录结果", force=True)
             
             if verify_login_success(page):
+                try:
+                    context.storage_state(path=AUTH_STATE_FILE)
+                    log_step(f"已保存登录状态: {AUTH_STATE_FILE}", "SUCCESS")
+                except Exception as e:
+                    log_step(f"保存登录状态失败: {e}", "WARN")
+                
                 log_step("="*60, "SUCCESS")
                 log_step("🎉 登录成功！", "SUCCESS")
                 log_step("="*60, "SUCCESS")
@@ -524,20 +626,13 @@ def run_login():
             
         except Exception as e:
             log_step(f"发生异常: {e}", "ERROR")
-            safe_screenshot(page, "exception_error.png")
-            
-            import traceback
-            print("\n" + "="*60)
-            print("详细错误信息:")
-            print("="*60)
-            traceback.print_exc()
-            print("="*60 + "\n")
-            
-            sys.exit(1)
+            safe_screenshot(page, "exception_error.png", force=True)
+            # 交给 Python 默认处理器输出完整堆栈并以状态码 1 退出
+            raise
             
         finally:
             browser.close()
 
 
 if __name__ == "__main__":
-    run_login()
+    run_login(*check_config())